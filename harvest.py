@@ -1,14 +1,24 @@
 """Script for harvesting metadata / full text from UNT Digital Library."""
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+import os
 import random
+import tempfile
 import time
 from untdl_harvest import oai, pdf
-import urllib.request
+import requests
 
 
 SERVER_URL = "https://digital.library.unt.edu"
+PDF_BASE_URL = f"{SERVER_URL}/ark:/"
 PDF_QUALIFIER = "/m2/1/high_res_d/"
 COLLECTIONS = {'UNTETD': 667, 'CRSR': 667, 'EOT': 666}
+DEFAULT_WORKERS = 8
+MAX_PDF_BYTES = 200 * 1024 * 1024
+PDF_SPOOL_BYTES = 16 * 1024 * 1024
+# The shared session asks for HTML by default, so PDF requests override it.
+PDF_HEADERS = {'Accept': 'application/pdf'}
 OPTIONS = {
     'metadataPrefix': 'untl_raw',
     'set': 'access_rights:public'
@@ -23,6 +33,15 @@ def parse_arguments():
     """Parses script arguments."""
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--path", dest="path", help="Output data path")
+    parser.add_argument("-w", "--workers", dest="workers", type=int,
+                        default=DEFAULT_WORKERS,
+                        help="Number of items to harvest concurrently")
+    parser.add_argument("--pdf-workers", dest="pdf_workers", type=int,
+                        default=1,
+                        help="Number of processes to extract PDF text with, "
+                             "shared by all items being harvested (each "
+                             "PDF being extracted is copied to a temp "
+                             "file for them to read)")
     return parser.parse_args()
 
 
@@ -38,63 +57,147 @@ def parse_ark_id(ark_id):
     return ark_naan, ark_name
 
 
-def harvest_pdf(ark_naan, ark_name):
-    """Tries to fetch the PDF data for a given item."""
-    pdf_url = f"{SERVER_URL}/ark:/{ark_naan}/{ark_name}/{PDF_QUALIFIER}"
-    with urllib.request.urlopen(pdf_url) as request:    
-        return request.read()
+def get_pdf_url(ark_naan, ark_name):
+    """Returns the URL for the PDF for a given item."""
+    return f"{PDF_BASE_URL}{ark_naan}/{ark_name}/{PDF_QUALIFIER}"
+
+
+def check_pdf(session, ark_naan, ark_name, max_bytes=MAX_PDF_BYTES):
+    """Checks that an item's PDF exists and isn't too big to download."""
+    response = session.head(
+        get_pdf_url(ark_naan, ark_name), headers=PDF_HEADERS,
+        allow_redirects=True
+    )
+    if response.status_code == 405:
+        # HEAD is not allowed; harvest_pdf will find out the hard way.
+        return
+    response.raise_for_status()
+    size = int(response.headers.get('Content-Length', '0'))
+    if size > max_bytes:
+        raise ValueError(f'PDF is too large ({size} bytes).')
+
+
+def harvest_pdf(session, ark_naan, ark_name, max_bytes=MAX_PDF_BYTES):
+    """Tries to fetch the PDF data for a given item.
+
+    Returns an open binary file object, which the caller must close.
+    The PDF is downloaded in chunks, giving up as soon as it turns out
+    to be larger than 'max_bytes'. PDFs larger than PDF_SPOOL_BYTES are
+    spooled to a temporary file rather than held in memory, so that
+    concurrent harvests don't each keep a huge PDF in RAM.
+    """
+    pdf_url = get_pdf_url(ark_naan, ark_name)
+    pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+    try:
+        with session.get(pdf_url, headers=PDF_HEADERS,
+                         stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                pdf_file.write(chunk)
+                if pdf_file.tell() > max_bytes:
+                    raise ValueError(f'PDF is larger than {max_bytes} bytes.')
+    except BaseException:
+        pdf_file.close()
+        raise
+    pdf_file.seek(0)
+    return pdf_file
 
 
 def save_xml_file(path_to_file, xml_doc):
-    """Saves the given XML file to disk."""
+    """Saves the given XML file (or already serialized bytes) to disk."""
+    if not isinstance(xml_doc, bytes):
+        xml_doc = xml_doc.tostring(encoding='utf-8', xml_declaration=True)
     with open(path_to_file, 'wb') as file:
-        file.write(xml_doc.tostring(
-            encoding='utf-8',
-            xml_declaration=True
-        ))
-
-
-def harvest_all_from_collection(collection, num, path, sleep=0.5):
-    """Harvest 'num' metadata/fulltext items from a UNTDL collection."""
+        file.write(xml_doc)
+        file.flush()
+        if hasattr(os, 'posix_fadvise'):
+            # We never read these files back, so tell the kernel it can
+            # start writing them out now and drop them from the cache.
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def harvest_item(harvester, ark_id, path, sleep=0.5, pdf_pool=None):
+    """Harvest and save the full text and metadata for one item.
+
+    If 'pdf_pool' is given (see pdf.make_process_pool), the PDF's text
+    is extracted by its processes. Raises an exception if any step
+    fails, in which case nothing is saved for the item.
+    """
+    ark_naan, ark_name = parse_ark_id(ark_id)
+    path_to_doc_text = f'{path}/{ark_name}-fulltext.xml'
+    path_to_metadata = f'{path}/{ark_name}-metadata.xml'
+    if os.path.exists(path_to_doc_text) and os.path.exists(path_to_metadata):
+        print(f'Item {ark_id} was already harvested.')
+        return ark_id
+    session = harvester.endpoint.session
+    # Do the cheap checks first, so that a failing item never costs a
+    # PDF download.
+    print(f'Checking PDF for item {ark_id}.')
+    check_pdf(session, ark_naan, ark_name)
+    print(f'Getting metadata record for item {ark_id}.')
+    md_record = harvester.get_record(ark_id)
+    print(f'Trying to get PDF for item {ark_id}.')
+    with harvest_pdf(session, ark_naan, ark_name) as pdf_file:
+        print(f'Extracting text for item {ark_id}.')
+        page_texts = pdf.extract_page_texts_from_bytes(pdf_file, pdf_pool)
+    doc_text = pdf.make_text_xml_bytes(page_texts)
+    print(f'Saving files for item {ark_id}.')
+    save_xml_file(path_to_doc_text, doc_text)
+    save_xml_file(path_to_metadata, md_record)
+    time.sleep(sleep)
+    return ark_id
+
+
+def harvest_all_from_collection(collection, num, path, sleep=0.5,
+                                workers=DEFAULT_WORKERS, pdf_workers=1):
+    """Harvest 'num' metadata/fulltext items from a UNTDL collection.
+
+    Up to 'workers' items are harvested at once, so that time spent
+    waiting on the server for one item overlaps with the others. When
+    an item fails, another one is tried in its place. If 'pdf_workers'
+    is greater than 1, all items share one pool of that many processes
+    for extracting PDF text.
+    """
     items = []
     harvester = get_oai_harvester(collection)
     print(f'Getting all IDs for collection {collection}.')
-    ark_ids = set(harvester.get_ids())
-    while ark_ids and len(items) < num:
-        print()
-        print(f'Item {len(items) + 1} of {num}.')
-        ark_id = random.choice(list(ark_ids))
-        ark_ids = ark_ids - {'ark_id'}
-        ark_naan, ark_name = parse_ark_id(ark_id)
-        try:
-            print(f'Trying to get PDF for item {ark_id}.')
-            pdf_bytes = harvest_pdf(ark_naan, ark_name)
-        except urllib.request.HTTPError as e:
-            print(f'Error! (HTTP {e.code}) Trying another item.')
-            continue
-        try:
-            print(f'Extracting text for item {ark_id}.')
-            parsed_doc_text = pdf.extract_text_as_xml_from_bytes(pdf_bytes)
-        except Exception:
-            print('Error! Trying another item.')
-            continue
-        try:
-            print(f'Getting metadata record for item {ark_id}.')
-            md_record = harvester.get_record(ark_id)
-        except Exception:
-            print('Error! Trying another item.')
-            continue
-        print('Saving files.')
-        path_to_doc_text = f'{path}/{ark_name}-fulltext.xml'
-        save_xml_file(path_to_doc_text, parsed_doc_text)
-        path_to_metadata = f'{path}/{ark_name}-metadata.xml'
-        save_xml_file(path_to_metadata, md_record)
-        items.append(ark_id)
-        time.sleep(sleep)
+    ark_ids = list(set(harvester.get_ids()))
+    random.shuffle(ark_ids)
+    pdf_pool = pdf.make_process_pool(pdf_workers) if pdf_workers > 1 else None
+    with pdf_pool or nullcontext(), \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        while len(items) < num:
+            while (ark_ids and len(pending) < workers
+                   and len(items) + len(pending) < num):
+                ark_id = ark_ids.pop()
+                future = executor.submit(
+                    harvest_item, harvester, ark_id, path, sleep, pdf_pool
+                )
+                pending[future] = ark_id
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ark_id = pending.pop(future)
+                try:
+                    items.append(future.result())
+                except requests.HTTPError as e:
+                    print(f'Error on {ark_id}! '
+                          f'(HTTP {e.response.status_code}) Trying another '
+                          f'item.')
+                    continue
+                except Exception:
+                    print(f'Error on {ark_id}! Trying another item.')
+                    continue
+                print(f'Item {len(items)} of {num} done ({ark_id}).')
     return items
 
 
 if __name__ == "__main__":
     args = parse_arguments()
     for collection, num_needed in COLLECTIONS.items():
-        items = harvest_all_from_collection(collection, num, args['path'])
+        items = harvest_all_from_collection(
+            collection, num_needed, args.path, workers=args.workers,
+            pdf_workers=args.pdf_workers
+        )
@@ -1,16 +1,192 @@
 """Contains classes and functions for interacting with OAI endpoints."""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import random
 import re
+import threading
 import time
-import urllib.request
-import xml.etree.ElementTree as ET
-import zlib
+from urllib.parse import urlencode
+
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+OAI_NAMESPACE = 'http://www.openarchives.org/OAI/2.0/'
+RETRY_STATUSES = (502, 503, 504)
+TAG_IDENTIFIER = f'{{{OAI_NAMESPACE}}}identifier'
+TAG_RECORD = f'{{{OAI_NAMESPACE}}}record'
+TAG_RESUMPTION_TOKEN = f'{{{OAI_NAMESPACE}}}resumptionToken'
+TAG_ERROR = f'{{{OAI_NAMESPACE}}}error'
+IDENTIFIER_RE = re.compile(
+    rb'<(?:[\w.-]+:)?identifier>([^<]+)</(?:[\w.-]+:)?identifier>'
+)
+RESUMPTION_TOKEN_RE = re.compile(
+    rb'<(?:[\w.-]+:)?resumptionToken[^>]*>([^<]*)'
+    rb'</(?:[\w.-]+:)?resumptionToken>'
+)
+ERROR_TAG_RE = re.compile(rb'<(?:[\w.-]+:)?error[\s>/]')
+XML_REFERENCE_RE = re.compile(
+    r'&(#x[0-9a-fA-F]+|#[0-9]+|lt|gt|amp|quot|apos);'
+)
+XML_ENTITIES = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': "'"}
+
+
+def encode_arguments(arguments):
+    """URL-encodes a dict of OAI arguments, skipping any that are None."""
+    pairs = [(k, v) for k, v in arguments.items() if v is not None]
+    return urlencode(pairs, safe=':')
 
 
 def make_querystring(verb, arguments):
-    """Makes a querystring for an OAI request from a verb + arguments."""
-    pairs = [('verb', verb)] + [(k, v) for k, v in arguments.items()]
-    qstring = '&'.join(f'{k}={v}' for k, v in pairs if v is not None)
-    return f'?{qstring}'
+    """Makes a querystring for an OAI request from a verb + arguments.
+
+    'arguments' may be a dict or a string that is already encoded (see
+    'encode_arguments'), for arguments that are reused many times.
+    """
+    if not isinstance(arguments, str):
+        arguments = encode_arguments(arguments)
+    if arguments:
+        return f'?verb={verb}&{arguments}'
+    return f'?verb={verb}'
+
+
+def expand_tagname(tagname, namespaces):
+    """Expands a tagname that uses a namespace prefix.
+
+    Tagnames that are already expanded ('{namespace}tag') are returned
+    as-is.
+    """
+    if tagname is not None and ':' in tagname and tagname[0] != '{':
+        prefix, field = tagname.split(':')
+        try:
+            return f"{{{namespaces[prefix]}}}{field}"
+        except KeyError:
+            raise ValueError(f"Unknown namespace prefix in '{tagname}'")
+    return tagname
+
+
+def _replace_xml_reference(match):
+    name = match.group(1)
+    if name[:2] == '#x':
+        return chr(int(name[2:], 16))
+    if name[0] == '#':
+        return chr(int(name[1:]))
+    return XML_ENTITIES[name]
+
+
+def _unescape_raw_text(raw_text):
+    # Resolves references the way an XML parser would, in one pass, so
+    # that e.g. '&amp;lt;' stays '&lt;'. (html.unescape is not the same:
+    # it maps '&#128;' to the euro sign, per HTML5.)
+    return XML_REFERENCE_RE.sub(
+        _replace_xml_reference, raw_text.decode('utf-8')
+    )
+
+
+def _has_cdata(raw_page):
+    # Text in CDATA sections is invisible to the regexes used on raw
+    # pages, so callers fall back on parsing pages that have any.
+    return b'<![CDATA[' in raw_page
+
+
+def find_resumption_token(raw_page):
+    """Finds the resumption token in a raw page, without parsing it.
+
+    Returns None if the page has no resumption token or an empty one,
+    i.e. if it is the last page.
+    """
+    if _has_cdata(raw_page):
+        rtoken = ETreeXmlDoc.fromstring(raw_page).find_tag(
+            TAG_RESUMPTION_TOKEN
+        )
+        return (rtoken.text or None) if rtoken is not None else None
+    match = RESUMPTION_TOKEN_RE.search(raw_page)
+    if match is None or not match.group(1):
+        return None
+    return _unescape_raw_text(match.group(1))
+
+
+# Prefixes registered for each namespace, since serializing with lxml
+# needs them (see '_copy_with_registered_prefixes').
+_registered_namespaces = {}
+
+
+def _register_namespaces(namespaces):
+    for prefix, namespace in namespaces.items():
+        if _registered_namespaces.get(prefix) != namespace:
+            ET.register_namespace(prefix, namespace)
+            _registered_namespaces[prefix] = namespace
+
+
+def _split_qname(qname):
+    if qname[:1] == '{':
+        namespace, _, localname = qname[1:].partition('}')
+        return namespace, localname
+    return None, qname
+
+
+def _copy_with_registered_prefixes(element, default_namespace=None):
+    # lxml ignores register_namespace when serializing and keeps
+    # whatever prefixes the source document used, so this rebuilds the
+    # tree with the registered prefixes declared on its root, the way
+    # ElementTree would write it. Namespaces that aren't registered
+    # keep their source prefix, or get an 'ns<n>' one if they had none.
+    registered = {ns: prefix for prefix, ns in _registered_namespaces.items()}
+    nsmap, prefixes = {}, {}
+    if default_namespace:
+        nsmap[None] = default_namespace
+        prefixes[default_namespace] = None
+    for el in element.iter(ET.Element):
+        source = None
+        for name in [el.tag, *el.attrib]:
+            namespace, _ = _split_qname(name)
+            if namespace is None or namespace in prefixes:
+                continue
+            prefix = registered.get(namespace)
+            if prefix is None or prefix in nsmap:
+                if source is None:
+                    source = {ns: p for p, ns in el.nsmap.items()}
+                prefix = source.get(namespace)
+            if prefix is None or prefix in nsmap:
+                prefix = f'ns{len(nsmap)}'
+            nsmap[prefix] = namespace
+            prefixes[namespace] = prefix
+    if not nsmap:
+        return element
+    nsmap = dict(sorted(nsmap.items(), key=lambda item: item[0] or ''))
+
+    def copy_node(node, parent):
+        if not isinstance(node.tag, str):
+            # Comments and processing instructions.
+            new = copy.copy(node)
+            parent.append(new)
+        else:
+            new = ET.SubElement(parent, node.tag, node.attrib)
+            new.text = node.text
+            for child in node:
+                copy_node(child, new)
+        new.tail = node.tail
+
+    root = ET.Element(element.tag, element.attrib, nsmap=nsmap)
+    root.text = element.text
+    for child in element:
+        copy_node(child, root)
+    return root
+
+
+def _make_lxml_parser():
+    # lxml parsers can't be shared between threads, so each parse gets
+    # its own. Never resolve entities in documents from a remote server.
+    return ET.XMLParser(resolve_entities=False)
 
 
 class EndpointError(Exception):
@@ -30,24 +206,57 @@ class OAIError(Exception):
 
 
 class ETreeXmlDoc:
-    """Simple wrapper around xml.etree.ElementTree."""
+    """Simple wrapper around lxml.etree or xml.etree.ElementTree.
+
+    lxml is used when it is installed, since its C parser/serializer is
+    considerably faster; otherwise this falls back on the standard
+    library's ElementTree.
+    """
+    # A wrapper is made for every element found, so keep them small.
+    __slots__ = ('root', 'namespaces', '_expanded')
 
     def __init__(self, etree_node, namespaces=None):
         """Initializes an ETreeXmlDoc object."""
         self.root = etree_node
         self.namespaces = namespaces or {}
-        for prefix, namespace in self.namespaces.items():
-            ET.register_namespace(prefix, namespace)
+        # Allocated on first use; most wrappers (e.g. for individual
+        # found elements) share their parent doc's instead.
+        self._expanded = None
+        _register_namespaces(self.namespaces)
+
+    def _wrap(self, element):
+        # Wrappers for elements found within this doc share its cache of
+        # expanded tagnames.
+        doc = type(self)(element, self.namespaces)
+        doc._expanded = self._expanded
+        return doc
 
     @classmethod
     def fromstring(cls, xml_str, namespaces=None):
         """Creates a new ETreeXmlDoc from an XML string."""
-        root_node = ET.fromstring(xml_str)
+        if isinstance(xml_str, str):
+            # lxml will not parse a str that has an encoding declaration.
+            xml_str = xml_str.encode('utf-8')
+        if HAS_LXML:
+            root_node = ET.fromstring(xml_str, parser=_make_lxml_parser())
+        else:
+            root_node = ET.fromstring(xml_str)
         return cls(root_node, namespaces)
 
     def tostring(self, encoding='us-ascii', method='xml', xml_declaration=None,
                  default_namespace=None, short_empty_elements=True):
-        """Returns the current XML document as a string."""
+        """Returns the current XML document as a string.
+
+        With lxml, namespace prefixes are written the way ElementTree
+        writes them: registered prefixes, declared on the root element.
+        The 'short_empty_elements' argument is ignored with lxml.
+        """
+        if HAS_LXML:
+            root = _copy_with_registered_prefixes(self.root, default_namespace)
+            return ET.tostring(
+                root, encoding=encoding, method=method,
+                xml_declaration=xml_declaration
+            )
         return ET.tostring(
             self.root, encoding=encoding, method=method,
             xml_declaration=xml_declaration,
@@ -64,26 +273,27 @@ class ETreeXmlDoc:
 
     def expand_tagname(self, tagname):
         """Expands a tagname that uses a namespace prefix."""
-        if tagname is not None and ':' in tagname:
-            prefix, field = tagname.split(':')
-            try:
-                return f"{{{self.namespaces[prefix]}}}{field}"
-            except KeyError:
-                raise ValueError(f"Unknown namespace prefix in '{tagname}'")
-        return tagname
+        if self._expanded is None:
+            self._expanded = {}
+        try:
+            return self._expanded[tagname]
+        except KeyError:
+            expanded = expand_tagname(tagname, self.namespaces)
+            self._expanded[tagname] = expanded
+            return expanded
 
     def find_tag(self, tag, text=None):
         """Finds the first matching element by tag."""
         for el in self.root.iter(self.expand_tagname(tag)):
             if text is None or text == el.text:
-                return type(self)(el, self.namespaces)
+                return self._wrap(el)
         return None
 
     def find_path(self, path, text=None):
         """Finds the first matching element by xpath."""
-        for el in self.root.iterfind(path):
+        for el in self.root.iterfind(path, self.namespaces):
             if text is None or text == el.text:
-                return type(self)(el, self.namespaces)
+                return self._wrap(el)
         return None
 
     def find_text(self, text):
@@ -94,13 +304,13 @@ class ETreeXmlDoc:
         """Returns a generator yielding all matching elements by tag."""
         for el in self.root.iter(self.expand_tagname(tag)):
             if text is None or text == el.text:
-                yield type(self)(el, self.namespaces)
+                yield self._wrap(el)
 
     def findall_path(self, path, text=None):
         """Returns a generator yielding all matching elements by xpath."""
-        for el in self.root.iterfind(path):
+        for el in self.root.iterfind(path, self.namespaces):
             if text is None or text == el.text:
-                yield type(self)(el, self.namespaces)
+                yield self._wrap(el)
     
     def findall_text(self, text, tag=None):
         """Returns a generator yielding all matching elements by text."""
@@ -120,26 +330,54 @@ class Endpoint:
             self.verbose = verbose
             self.sleep_time = sleep_time
             self.max_recoveries = max_recoveries
-            self.num_recoveries = 0
             self.raw_bytes = 0
             self.data_bytes = 0
             self.default_recovery_time = 60
-            self.http_error_class = urllib.request.HTTPError
+            self.http_error_class = requests.HTTPError
             self.http_errors = []
             self.oai_error = ''
             self.headers = {
                 'User-Agent': 'untdl_harvest',
                 'Accept': 'text/html',
-                'Accept-Encoding': 'compress, deflate'
+                'Accept-Encoding': 'gzip, deflate'
             }
+            self.session = self._make_session()
             self.namespaces = namespaces or {}
             if 'oai' not in self.namespaces:
-                self.namespaces['oai'] = 'http://www.openarchives.org/OAI/2.0/'
+                self.namespaces['oai'] = OAI_NAMESPACE
             self.xml_doc_class = ETreeXmlDoc
             self.last_page = None
+            # An endpoint may be shared by several threads (e.g. the
+            # page prefetcher, or concurrent GetRecord calls), so its
+            # counters and error state are updated under this lock.
+            self._lock = threading.Lock()
+
+    def _make_session(self):
+        # One pooled session per endpoint, so that every page (and
+        # anything else fetched from the same server) reuses open
+        # connections instead of doing a new TCP/TLS handshake. 503s
+        # and other transient gateway errors are retried here with
+        # jittered backoff, honoring the server's Retry-After.
+        retry = Retry(
+            total=self.max_recoveries, backoff_factor=0.5,
+            backoff_jitter=0.5, status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True, raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=10, pool_maxsize=50, max_retries=retry
+        )
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
 
     def _bail(self, why_bail=None):
-        http_errstr = ', '.join([e.code for e in self.http_errors])
+        with self._lock:
+            http_errors = list(self.http_errors)
+        http_errstr = ', '.join(
+            [str(e.response.status_code) for e in http_errors]
+        )
         deets = ''.join([
             f" {why_bail}" if why_bail else "",
             f" HTTP Errors: {http_errstr}" if http_errstr else "",
@@ -150,89 +388,208 @@ class Endpoint:
         )
 
     def _send_request(self, req_url):
-        req = urllib.request.Request(req_url, headers=self.headers)
-        with urllib.request.urlopen(req) as response:
-            return response.read()
+        response = self.session.get(req_url)
+        response.raise_for_status()
+        # requests decodes the body per its Content-Encoding; tell()
+        # on the underlying urllib3 response is the size on the wire.
+        data = response.content
+        with self._lock:
+            self.raw_bytes += response.raw.tell() or len(data)
+        return data
 
-    def _handle_http_error(self, error, verb, arguments):
+    def _get_recovery_time(self, last_recovery_time):
+        # "Decorrelated jitter": a random wait between 1 second and 3x
+        # the last wait, capped at the default, so that many harvesters
+        # failing at once don't all retry in lockstep.
+        return min(
+            self.default_recovery_time,
+            random.uniform(1, max(1, last_recovery_time) * 3)
+        )
+
+    def _handle_http_error(self, error, num_recoveries, last_recovery_time):
+        # Returns how long to wait before retrying the request, or bails.
         if self.verbose:
             print(f'Error: {error}')
-        self.http_errors.append(error)
-        if error.code == 503:
-            retry_wait = int(error.hdrs.get('Retry-After', '-1'))
+        with self._lock:
+            self.http_errors.append(error)
+        # The session has already retried RETRY_STATUSES; don't
+        # multiply its retries with our own.
+        if error.response.status_code in RETRY_STATUSES:
+            self._bail('Server still unavailable after retrying.')
+        if num_recoveries >= self.max_recoveries:
+            self._bail('Exceeded max number of recovery attempts.')
+        retry_after = error.response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            retry_wait = int(retry_after)
         else:
-            if self.num_recoveries >= self.max_recoveries:
-                self._bail('Exceeded max number of recovery attempts.')
-            self.max_recoveries += 1
-            retry_wait = self.default_recovery_time
-        if retry_wait < 0:
-            self._bail('Retries are disabled.')
+            retry_wait = self._get_recovery_time(last_recovery_time)
         if self.verbose:
-            print(f'Retrying in {retry_wait} seconds.')
-        return self.get_page(verb, arguments, retry_wait)
-
-    def _catch_and_handle_oai_error(self, data):
-        oai_error = re.search('<error *code=\"([^"]*)">(.*)</error>', data)
-        if oai_error:
-            code = oai_error.group(1)
-            msg = oai_error.group(2)
-            self.oai_error = OAIError(code, msg)
-            self._bail()
-        return data
-
-    def _decompress(self, data):
-        try:
-            return zlib.decompressobj().decompress(data)
-        except zlib.error:
-            pass
+            print(f'Retrying in {retry_wait:.1f} seconds.')
+        return retry_wait
+
+    def _handle_oai_error(self, error_node):
+        with self._lock:
+            self.oai_error = OAIError(
+                error_node.get('code'), error_node.text
+            )
+        self._bail()
+
+    def _catch_and_handle_oai_error(self, page):
+        error = page.find_path(TAG_ERROR)
+        if error is not None:
+            self._handle_oai_error(error.root)
+        return page
+
+    def _catch_and_handle_raw_oai_error(self, raw_page):
+        # Only pay for a parse in the rare case that a page might be an
+        # error. A false positive just means an unneeded parse.
+        if ERROR_TAG_RE.search(raw_page):
+            self.parse_page(raw_page)
+        return raw_page
+
+    def _get_data(self, verb, arguments, sleep_time=None):
+        sleep_time = self.sleep_time if sleep_time is None else sleep_time
+        req_url = ''.join([self.url, make_querystring(verb, arguments)])
+        # Recoveries are counted per request, so that requests made by
+        # other threads succeeding in the meantime don't reset them.
+        num_recoveries = 0
+        recovery_time = 0
+        while True:
+            if sleep_time:
+                time.sleep(sleep_time)
+            if self.verbose:
+                print("\r", f"Endpoint.get_page ...'{req_url[-90:]}'")
+            try:
+                return self._send_request(req_url)
+            except self.http_error_class as error:
+                recovery_time = self._handle_http_error(
+                    error, num_recoveries, recovery_time
+                )
+            num_recoveries += 1
+            sleep_time = recovery_time
+
+    def get_raw_page(self, verb, arguments, sleep_time=None):
+        """Gets one page of data from this endpoint as unparsed bytes.
+
+        The page is not checked for an OAI error; that is left to
+        whatever parses or scans it.
+        """
+        data = self._get_data(verb, arguments, sleep_time)
+        with self._lock:
+            self.data_bytes += len(data)
         return data
 
     def get_page(self, verb, arguments, sleep_time=None):
         """Gets one page of data from this endpoint."""
-        sleep_time = self.sleep_time if sleep_time is None else sleep_time
-        if sleep_time:
-            time.sleep(sleep_time)
-        req_url = ''.join([self.url, make_querystring(verb, arguments)])
-        if self.verbose:
-            print("\r", f"Endpoint.get_page ...'{req_url[-90:]}'")
-        try:
-            data = self._send_request(req_url)
-        except self.http_error_class as error:
-            data = self._handle_http_error(error, verb, arguments)
-        self.raw_bytes += len(data)
-        data = self._decompress(data).decode('utf-8')
-        self.data_bytes += len(data)
-        data = self._catch_and_handle_oai_error(data)
-        self.last_page = self.xml_doc_class.fromstring(data, self.namespaces)
-        return self.last_page
+        page = self.parse_page(self.get_raw_page(verb, arguments, sleep_time))
+        with self._lock:
+            self.last_page = page
+        return page
+
+    def iter_raw_pages(self, verb, arguments):
+        """Returns a generator yielding all pages of data as unparsed bytes.
+
+        As soon as a page arrives, its resumption token is pulled from
+        the raw bytes and the next page is requested in the background,
+        so that the server is producing the next page while the caller
+        processes the current one.
+        """
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            next_page = prefetcher.submit(self.get_raw_page, verb, arguments)
+            while next_page is not None:
+                raw_page = next_page.result()
+                rtoken = find_resumption_token(raw_page)
+                if rtoken is None:
+                    next_page = None
+                else:
+                    next_page = prefetcher.submit(
+                        self.get_raw_page, verb, {'resumptionToken': rtoken}
+                    )
+                yield raw_page
+
+    def parse_page(self, raw_page):
+        """Parses a raw page of data from this endpoint.
+
+        Raises an EndpointError if the page is an OAI error.
+        """
+        page = self.xml_doc_class.fromstring(raw_page, self.namespaces)
+        return self._catch_and_handle_oai_error(page)
+
+    def iter_pages(self, verb, arguments):
+        """Returns a generator yielding all pages of data, parsed.
+
+        Pages are prefetched (see 'iter_raw_pages').
+        """
+        for raw_page in self.iter_raw_pages(verb, arguments):
+            yield self.parse_page(raw_page)
 
     def compile_data(self, verb, arguments, docfilter):
-        """Gets and compiles all pages of data from this endpoint."""
+        """Gets and compiles all pages of data from this endpoint.
+
+        Each parsed page is passed to 'docfilter', which returns the
+        data to keep from it. Pages are prefetched (see
+        'iter_raw_pages').
+        """
         data = []
-        while True:
-            page = self.get_page(verb, arguments)
+        for page in self.iter_pages(verb, arguments):
             data.extend(docfilter(page))
-            rtoken = page.find_tag('oai:resumptionToken')
-            if rtoken is None:
-                break
-            arguments = {'resumptionToken': rtoken.text}
         return data
 
+    def iter_raw_data(self, verb, arguments, rawfilter):
+        """Returns a generator yielding data from all pages, unparsed.
+
+        Each page's raw bytes are passed to 'rawfilter', which returns
+        the data to keep from it. This is much cheaper than parsing
+        when the data needed is simple enough to pull out of the bytes
+        directly, such as identifiers. A page is only ever parsed if it
+        might be an OAI error. Pages are prefetched (see
+        'iter_raw_pages').
+        """
+        for raw_page in self.iter_raw_pages(verb, arguments):
+            self._catch_and_handle_raw_oai_error(raw_page)
+            yield from rawfilter(raw_page)
+
+    def compile_raw_data(self, verb, arguments, rawfilter):
+        """Gets and compiles all pages of data, without parsing them.
+
+        See 'iter_raw_data'.
+        """
+        return list(self.iter_raw_data(verb, arguments, rawfilter))
+
+    def stream_ids(self, arguments):
+        """Returns a generator yielding all IDs matching 'arguments'.
+
+        IDs are yielded as each page of ListIdentifiers arrives, straight
+        from the raw bytes (see 'iter_raw_data').
+        """
+        return self.iter_raw_data('ListIdentifiers', arguments, rawfilter_ids)
+
 
 def docfilter_ids(page):
     """Compiles only IDs from a page of records."""
-    return [el.text for el in page.findall_tag('oai:identifier')]
+    return [el.text for el in page.findall_tag(TAG_IDENTIFIER)]
+
+
+def rawfilter_ids(raw_page):
+    """Compiles only IDs from a raw page of identifiers, without parsing.
+
+    Pages with CDATA sections are parsed after all (see 'docfilter_ids').
+    """
+    if _has_cdata(raw_page):
+        return docfilter_ids(ETreeXmlDoc.fromstring(raw_page))
+    return [_unescape_raw_text(m) for m in IDENTIFIER_RE.findall(raw_page)]
 
 
 def docfilter_records(page):
     """Compiles records from a page of records."""
-    return list(page.findall_tag('oai:record'))
+    return list(page.findall_tag(TAG_RECORD))
 
 
 class Harvester:
     """Class for harvesting data from an Endpoint."""
 
-    def __init__(self, endpoint, options, namespaces, verbose=True):
+    def __init__(self, endpoint, options, namespaces, verbose=True,
+                 record_cache_size=4096):
         """Initialize a Harvester object."""
         self.endpoint = Endpoint(endpoint, namespaces=namespaces)
         self.verbose = verbose
@@ -242,25 +599,67 @@ class Harvester:
             'until': options.get('until'),
             'set': options.get('set')
         }
-
-    def get_ids(self, docfilter=docfilter_ids):
-        """Gets a list of IDs available from a given OAI endpoint."""
-        return self.endpoint.compile_data(
-            'ListIdentifiers', self.options, docfilter
+        # These arguments are the same for every request, so encode
+        # them once up front.
+        self._encoded_options = encode_arguments(self.options)
+        self._encoded_prefix = encode_arguments(
+            {'metadataPrefix': self.options['metadataPrefix']}
+        )
+        # Raw GetRecord pages for the most recently fetched records,
+        # least recently used first.
+        self.record_cache_size = record_cache_size
+        self._record_pages = OrderedDict()
+        self._record_lock = threading.Lock()
+
+    def get_ids(self, docfilter=None, rawfilter=rawfilter_ids):
+        """Gets a list of IDs available from a given OAI endpoint.
+
+        ListIdentifiers pages are flat and simple, so by default the IDs
+        are pulled straight from the raw page bytes by 'rawfilter'
+        instead of parsing each page. If a 'docfilter' is given, each
+        page is parsed and passed to it instead.
+        """
+        if docfilter is not None:
+            return self.endpoint.compile_data(
+                'ListIdentifiers', self._encoded_options, docfilter
+            )
+        return self.endpoint.compile_raw_data(
+            'ListIdentifiers', self._encoded_options, rawfilter
         )
 
+    def stream_ids(self):
+        """Returns a generator yielding IDs as the endpoint returns them."""
+        return self.endpoint.stream_ids(self._encoded_options)
+
     def list_records(self, docfilter=docfilter_records):
         """Gets a list of records from a given OAI endpoint."""
-        command = f'ListRecords&{self.make_option_string()}'
         return self.endpoint.compile_data(
-            'ListRecords', self.options, docfilter
+            'ListRecords', self._encoded_options, docfilter
         )
 
     def get_record(self, identifier):
-        """Gets a single record from a given OAI endpoint."""
-        arguments = {
-            'metadataPrefix': self.options['metadataPrefix'],
-            'identifier': identifier
-        }
-        page = self.endpoint.get_page('GetRecord', arguments)
-        return page.find_tag('oai:record')
+        """Gets a single record from a given OAI endpoint.
+
+        The raw pages for the most recently fetched records are cached,
+        so getting a record again parses it afresh instead of going
+        back to the endpoint. Records that aren't found aren't cached.
+        """
+        with self._record_lock:
+            raw_page = self._record_pages.get(identifier)
+            if raw_page is not None:
+                self._record_pages.move_to_end(identifier)
+        if raw_page is not None:
+            return self.endpoint.parse_page(raw_page).find_tag(TAG_RECORD)
+        arguments = '&'.join([
+            self._encoded_prefix,
+            encode_arguments({'identifier': identifier})
+        ])
+        raw_page = self.endpoint.get_raw_page('GetRecord', arguments)
+        record = self.endpoint.parse_page(raw_page).find_tag(TAG_RECORD)
+        if record is not None and self.record_cache_size:
+            with self._record_lock:
+                self._record_pages[identifier] = raw_page
+                self._record_pages.move_to_end(identifier)
+                if len(self._record_pages) > self.record_cache_size:
+                    self._record_pages.popitem(last=False)
+        return record
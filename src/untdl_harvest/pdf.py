@@ -1,29 +1,156 @@
 """Contains classes and functions for extracting and parsing PDF text."""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
-import xml.etree.ElementTree as ET
+import itertools
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
 
 import pypdf
 
-from untdl_harvest.oai import ETreeXmlDoc
+from untdl_harvest.oai import ET, ETreeXmlDoc
+
+
+# Extracted text can contain characters that XML 1.0 doesn't allow
+# (e.g. form feeds or NULs), which lxml refuses to put in a document.
+INVALID_XML_CHARS_RE = re.compile(
+    '[^\t\n\r\u0020-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]'
+)
 
 
 def make_pdf_reader_from_bytes(pdf_bytes):
-    """Initialize a pypdf.PdfReader from PFD bytes."""
+    """Initialize a pypdf.PdfReader from PDF bytes.
+
+    An open binary file object may be passed instead of bytes, in which
+    case the reader reads from it directly.
+    """
+    if hasattr(pdf_bytes, 'read'):
+        return pypdf.PdfReader(pdf_bytes)
     return pypdf.PdfReader(BytesIO(pdf_bytes))
 
 
-def extract_text_as_xml(reader):
-    """Extract text as basic XML from the given PdfReader object."""
+def extract_page_texts(reader):
+    """Extract the text of each page from the given PdfReader object."""
+    return [pdf_page.extract_text() for pdf_page in reader.pages]
+
+
+def make_process_pool(workers):
+    """Start a pool of processes for extracting PDF text in parallel.
+
+    Starting processes is slow, so make one pool and pass it to every
+    'extract_page_texts_from_bytes' call. The processes are spawned,
+    not forked: PDFs are usually extracted from harvester threads, and
+    forking a process that has other threads running isn't safe.
+    """
+    mp_context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(workers, mp_context=mp_context)
+
+
+# Each worker process keeps readers open for the last few PDFs it has
+# been given pages from, rather than re-reading a PDF for every page.
+WORKER_READERS = 4
+_worker_readers = OrderedDict()
+_pdf_ids = itertools.count()
+
+
+def _get_worker_reader(pdf_key):
+    try:
+        _worker_readers.move_to_end(pdf_key)
+        return _worker_readers[pdf_key][1]
+    except KeyError:
+        pass
+    pdf_file = open(pdf_key[0], 'rb')
+    _worker_readers[pdf_key] = (pdf_file, pypdf.PdfReader(pdf_file))
+    if len(_worker_readers) > WORKER_READERS:
+        old_file, _ = _worker_readers.popitem(last=False)[1]
+        old_file.close()
+    return _worker_readers[pdf_key][1]
+
+
+def _extract_worker_page_text(pdf_key, page_index):
+    return _get_worker_reader(pdf_key).pages[page_index].extract_text()
+
+
+def _extract_page_texts_in_pool(pdf_path, num_pages, pool):
+    # The PDF's path goes to the workers instead of its data, and the
+    # ID makes sure a worker never reuses a reader for an old file that
+    # happened to have the same path.
+    pdf_key = (pdf_path, next(_pdf_ids))
+    return list(pool.map(
+        _extract_worker_page_text, itertools.repeat(pdf_key, num_pages),
+        range(num_pages)
+    ))
+
+
+def extract_page_texts_from_bytes(pdf_bytes, pool=None):
+    """Extract the text of each page from PDF bytes (or a file object).
+
+    Text extraction is CPU-bound and independent per page, so if a
+    'pool' (see 'make_process_pool') is given, pages are extracted in
+    parallel by its processes. The workers read the PDF from disk, so
+    unless a file object is a named file on disk, the PDF is first
+    copied to a temporary file.
+    """
+    reader = make_pdf_reader_from_bytes(pdf_bytes)
+    num_pages = len(reader.pages)
+    if pool is None or num_pages < 2:
+        return extract_page_texts(reader)
+    pdf_path = getattr(pdf_bytes, 'name', None)
+    if isinstance(pdf_path, str) and os.path.isfile(pdf_path):
+        return _extract_page_texts_in_pool(pdf_path, num_pages, pool)
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+        if hasattr(pdf_bytes, 'read'):
+            pdf_bytes.seek(0)
+            shutil.copyfileobj(pdf_bytes, pdf_file)
+        else:
+            pdf_file.write(pdf_bytes)
+        pdf_file.flush()
+        return _extract_page_texts_in_pool(pdf_file.name, num_pages, pool)
+
+
+def clean_text(text):
+    """Remove characters that aren't allowed in XML from text."""
+    return INVALID_XML_CHARS_RE.sub('', text)
+
+
+def make_text_xml(page_texts):
+    """Make a basic XML document from a list of page texts."""
     root = ET.Element('document')
     root.text = '\n'
-    for pdf_page in reader.pages:
+    for page_text in page_texts:
         text_page = ET.SubElement(root, 'page')
-        text_page.text = f'\n{pdf_page.extract_text()}\n'
+        text_page.text = f'\n{clean_text(page_text)}\n'
         text_page.tail = '\n'
     return ETreeXmlDoc(root)
 
 
-def extract_text_as_xml_from_bytes(pdf_bytes):
+def make_text_xml_bytes(page_texts):
+    """Make a basic XML document from a list of page texts, as bytes.
+
+    Produces the same document as 'make_text_xml', serialized as UTF-8
+    the way lxml does it, but writes it directly instead of building an
+    element tree first. Carriage returns are written as character
+    references so they survive a round trip through a parser.
+    """
+    parts = [b"<?xml version='1.0' encoding='utf-8'?>\n<document>\n"]
+    for page_text in page_texts:
+        parts.append(b'<page>\n')
+        page_text = escape(clean_text(page_text), {'\r': '&#13;'})
+        parts.append(page_text.encode('utf-8'))
+        parts.append(b'\n</page>\n')
+    parts.append(b'</document>')
+    return b''.join(parts)
+
+
+def extract_text_as_xml(reader):
+    """Extract text as basic XML from the given PdfReader object."""
+    return make_text_xml(extract_page_texts(reader))
+
+
+def extract_text_as_xml_from_bytes(pdf_bytes, pool=None):
     """Extract text from PDF bytes, return as basic XML."""
-    reader = make_pdf_reader_from_bytes(pdf_bytes)
-    return extract_text_as_xml(reader)
+    return make_text_xml(extract_page_texts_from_bytes(pdf_bytes, pool))
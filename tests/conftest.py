@@ -0,0 +1,42 @@
+"""Shared fixtures for the untdl_harvest tests."""
+from io import BytesIO
+from pathlib import Path
+import sys
+
+import pypdf
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+import pytest
+
+# harvest.py is a script rather than part of the package; make it
+# importable for its tests.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def make_pdf():
+    """Makes the bytes of a PDF with one page per string in 'texts',
+    each showing that string.
+    """
+    def _make_pdf(texts):
+        writer = pypdf.PdfWriter()
+        font = writer._add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+        }))
+        for text in texts:
+            page = writer.add_blank_page(width=200, height=200)
+            page[NameObject('/Resources')] = DictionaryObject({
+                NameObject('/Font'): DictionaryObject({
+                    NameObject('/F1'): font
+                })
+            })
+            contents = DecodedStreamObject()
+            contents.set_data(
+                b'BT /F1 12 Tf 10 100 Td (%s) Tj ET' % text.encode('ascii')
+            )
+            page[NameObject('/Contents')] = writer._add_object(contents)
+        pdf_file = BytesIO()
+        writer.write(pdf_file)
+        return pdf_file.getvalue()
+    return _make_pdf
@@ -0,0 +1,262 @@
+"""Tests for the harvest.py script."""
+from io import BytesIO
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import harvest
+from untdl_harvest import oai
+
+
+RECORD_XML = (
+    b'<oai:record xmlns:oai="http://www.openarchives.org/OAI/2.0/">'
+    b'<oai:header><oai:identifier>ark:/67531/metadc1</oai:identifier>'
+    b'</oai:header></oai:record>'
+)
+
+
+def make_response(status_code=200, body=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = BytesIO(body)
+    return response
+
+
+class FakeSession:
+    """Stands in for a requests.Session, serving canned responses."""
+
+    def __init__(self, head=None, get=None):
+        # (Responses for HTTP errors are falsy.)
+        self.head_response = make_response() if head is None else head
+        self.get_response = make_response() if get is None else get
+        self.calls = []
+
+    def head(self, url, **kwargs):
+        self.calls.append(('HEAD', url, kwargs))
+        return self.head_response
+
+    def get(self, url, **kwargs):
+        self.calls.append(('GET', url, kwargs))
+        return self.get_response
+
+
+class FakeHarvester:
+    """Stands in for an oai.Harvester."""
+
+    def __init__(self, ids=(), session=None, record=RECORD_XML):
+        self.ids = list(ids)
+        self.endpoint = SimpleNamespace(session=session or FakeSession())
+        self.record = record
+        self.records_got = []
+
+    def get_ids(self):
+        return list(self.ids)
+
+    def get_record(self, identifier):
+        self.records_got.append(identifier)
+        return oai.ETreeXmlDoc.fromstring(self.record)
+
+
+def test_parse_ark_id():
+    assert harvest.parse_ark_id('ark:/67531/metadc1') == ('67531', 'metadc1')
+
+
+def test_check_pdf():
+    session = FakeSession(head=make_response(headers={'Content-Length': '10'}))
+    harvest.check_pdf(session, '67531', 'metadc1', max_bytes=10)
+    method, url, kwargs = session.calls[0]
+    assert method == 'HEAD'
+    assert url == harvest.get_pdf_url('67531', 'metadc1')
+    assert kwargs['headers'] == {'Accept': 'application/pdf'}
+    assert kwargs['allow_redirects']
+
+
+def test_check_pdf_too_large():
+    session = FakeSession(head=make_response(headers={'Content-Length': '11'}))
+    with pytest.raises(ValueError):
+        harvest.check_pdf(session, '67531', 'metadc1', max_bytes=10)
+
+
+def test_check_pdf_missing():
+    session = FakeSession(head=make_response(404))
+    with pytest.raises(requests.HTTPError):
+        harvest.check_pdf(session, '67531', 'metadc1')
+
+
+def test_check_pdf_head_not_allowed():
+    session = FakeSession(head=make_response(405))
+    harvest.check_pdf(session, '67531', 'metadc1')
+
+
+def test_harvest_pdf(monkeypatch):
+    monkeypatch.setattr(harvest, 'PDF_SPOOL_BYTES', 4)
+    data = b'%PDF-' + b'x' * 100
+    session = FakeSession(get=make_response(body=data))
+    with harvest.harvest_pdf(session, '67531', 'metadc1') as pdf_file:
+        assert pdf_file.read() == data
+        # Anything past PDF_SPOOL_BYTES goes to disk.
+        assert pdf_file._rolled
+    method, url, kwargs = session.calls[0]
+    assert (method, url) == ('GET', harvest.get_pdf_url('67531', 'metadc1'))
+    assert kwargs['headers'] == {'Accept': 'application/pdf'}
+    assert kwargs['stream']
+
+
+def test_harvest_pdf_too_large():
+    session = FakeSession(get=make_response(body=b'x' * (1 << 17)))
+    with pytest.raises(ValueError):
+        harvest.harvest_pdf(session, '67531', 'metadc1', max_bytes=1 << 16)
+
+
+def test_harvest_pdf_missing():
+    session = FakeSession(get=make_response(404))
+    with pytest.raises(requests.HTTPError):
+        harvest.harvest_pdf(session, '67531', 'metadc1')
+
+
+@pytest.mark.parametrize('as_bytes', [True, False])
+def test_save_xml_file(tmp_path, as_bytes):
+    doc = oai.ETreeXmlDoc.fromstring(RECORD_XML)
+    path = tmp_path / 'record.xml'
+    if as_bytes:
+        harvest.save_xml_file(path, doc.tostring(encoding='utf-8'))
+    else:
+        harvest.save_xml_file(path, doc)
+    saved = oai.ETreeXmlDoc.fromstring(path.read_bytes())
+    assert saved.find_tag(oai.TAG_IDENTIFIER).text == 'ark:/67531/metadc1'
+
+
+@pytest.mark.skipif(not hasattr(os, 'posix_fadvise'),
+                    reason='posix_fadvise is not available')
+def test_save_xml_file_drops_cache(tmp_path, monkeypatch):
+    advice = []
+    monkeypatch.setattr(harvest.os, 'posix_fadvise',
+                        lambda fd, offset, length, flag: advice.append(flag))
+    harvest.save_xml_file(tmp_path / 'record.xml', RECORD_XML)
+    assert advice == [os.POSIX_FADV_DONTNEED]
+
+
+def test_harvest_item(tmp_path, make_pdf):
+    session = FakeSession(get=make_response(body=make_pdf(['One', 'Two'])))
+    harvester = FakeHarvester(session=session)
+    ark_id = 'ark:/67531/metadc1'
+    assert harvest.harvest_item(harvester, ark_id, tmp_path, 0) == ark_id
+    assert [call[0] for call in session.calls] == ['HEAD', 'GET']
+    assert harvester.records_got == [ark_id]
+    text = oai.ETreeXmlDoc.fromstring(
+        (tmp_path / 'metadc1-fulltext.xml').read_bytes()
+    )
+    assert [p.text for p in text.findall_tag('page')] == [
+        '\nOne\n', '\nTwo\n'
+    ]
+    metadata = oai.ETreeXmlDoc.fromstring(
+        (tmp_path / 'metadc1-metadata.xml').read_bytes()
+    )
+    assert metadata.find_tag(oai.TAG_IDENTIFIER).text == ark_id
+
+
+def test_harvest_item_checks_pdf_first(tmp_path):
+    session = FakeSession(head=make_response(404))
+    harvester = FakeHarvester(session=session)
+    with pytest.raises(requests.HTTPError):
+        harvest.harvest_item(harvester, 'ark:/67531/metadc1', tmp_path, 0)
+    assert [call[0] for call in session.calls] == ['HEAD']
+    assert harvester.records_got == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_harvest_item_skips_harvested_items(tmp_path):
+    (tmp_path / 'metadc1-fulltext.xml').write_bytes(b'<document/>')
+    (tmp_path / 'metadc1-metadata.xml').write_bytes(RECORD_XML)
+    harvester = FakeHarvester()
+    ark_id = 'ark:/67531/metadc1'
+    assert harvest.harvest_item(harvester, ark_id, tmp_path, 0) == ark_id
+    assert harvester.endpoint.session.calls == []
+    assert harvester.records_got == []
+
+
+@pytest.fixture
+def fake_harvest(monkeypatch):
+    """Replaces the harvester and harvest_item for
+    harvest_all_from_collection, recording what gets harvested.
+
+    IDs containing 'bad' fail.
+    """
+    ids = [f'ark:/1/good{i}' for i in range(10)]
+    ids += ['ark:/1/bad1', 'ark:/1/bad2', 'ark:/1/bad3']
+    harvested = SimpleNamespace(ids=ids, tried=[], running=0, max_running=0,
+                                pdf_pools=set())
+    lock = threading.Lock()
+
+    def harvest_item(harvester, ark_id, path, sleep, pdf_pool=None):
+        with lock:
+            harvested.tried.append(ark_id)
+            harvested.pdf_pools.add(pdf_pool)
+            harvested.running += 1
+            harvested.max_running = max(
+                harvested.running, harvested.max_running
+            )
+        try:
+            time.sleep(0.01)
+            if 'bad1' in ark_id:
+                response = make_response(404)
+                raise requests.HTTPError('404 Error', response=response)
+            if 'bad' in ark_id:
+                raise ValueError('Not a PDF.')
+            return ark_id
+        finally:
+            with lock:
+                harvested.running -= 1
+
+    monkeypatch.setattr(harvest, 'get_oai_harvester',
+                        lambda collection: FakeHarvester(ids + ids))
+    monkeypatch.setattr(harvest, 'harvest_item', harvest_item)
+    return harvested
+
+
+def test_harvest_all_from_collection(fake_harvest, tmp_path):
+    items = harvest.harvest_all_from_collection('TEST', 8, tmp_path, 0,
+                                                workers=3)
+    assert len(items) == 8
+    assert all('good' in item for item in items)
+    assert len(set(fake_harvest.tried)) == len(fake_harvest.tried)
+    assert 1 < fake_harvest.max_running <= 3
+    assert fake_harvest.pdf_pools == {None}
+
+
+def test_harvest_all_from_collection_runs_out_of_items(fake_harvest,
+                                                       tmp_path):
+    items = harvest.harvest_all_from_collection('TEST', 20, tmp_path, 0,
+                                                workers=4)
+    assert sorted(items) == sorted(i for i in fake_harvest.ids if 'good' in i)
+    assert sorted(fake_harvest.tried) == sorted(fake_harvest.ids)
+
+
+def test_harvest_all_from_collection_shares_pdf_pool(fake_harvest, tmp_path,
+                                                     monkeypatch):
+    pools = []
+
+    class FakePool:
+        def __init__(self, workers):
+            self.workers = workers
+            self.shut_down = False
+            pools.append(self)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            self.shut_down = True
+
+    monkeypatch.setattr(harvest.pdf, 'make_process_pool', FakePool)
+    harvest.harvest_all_from_collection('TEST', 5, tmp_path, 0, workers=3,
+                                        pdf_workers=2)
+    assert len(pools) == 1
+    assert pools[0].workers == 2
+    assert pools[0].shut_down
+    assert fake_harvest.pdf_pools == {pools[0]}
@@ -0,0 +1,579 @@
+"""Tests for the untdl_harvest.oai module."""
+import threading
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+import xml.etree.ElementTree as StdlibET
+
+import pytest
+import requests
+
+from untdl_harvest import oai
+
+
+OAI_HEAD = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+)
+OAI_TAIL = b'</OAI-PMH>'
+
+
+def make_page(body):
+    return b''.join([OAI_HEAD, body, OAI_TAIL])
+
+
+def make_id_page(ids, token=b''):
+    headers = b''.join(
+        b'<header><identifier>%s</identifier></header>' % i for i in ids
+    )
+    return make_page(b'<ListIdentifiers>%s%s</ListIdentifiers>' % (
+        headers, token
+    ))
+
+
+def make_record(ident, title):
+    return (
+        b'<record><header><identifier>%s</identifier></header>'
+        b'<metadata><untl:metadata '
+        b'xmlns:untl="http://digital2.library.unt.edu/untl/">'
+        b'<untl:title>%s</untl:title></untl:metadata></metadata></record>'
+    ) % (ident, title)
+
+
+def make_records_page(records, token=b''):
+    return make_page(b'<ListRecords>%s%s</ListRecords>' % (
+        b''.join(records), token
+    ))
+
+
+def make_http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(f'{status_code} Error', response=response)
+
+
+ERROR_PAGE = make_page(
+    b'<error code="badResumptionToken">The token is invalid.</error>'
+)
+
+NAMESPACES = {
+    'oai': 'http://www.openarchives.org/OAI/2.0/',
+    'untl': 'http://digital2.library.unt.edu/untl/'
+}
+FIRST_PAGE = (('metadataPrefix', 'oai_dc'),)
+
+
+@pytest.fixture(params=['lxml', 'ElementTree'])
+def etree_backend(request, monkeypatch):
+    """Runs a test with lxml (if installed) and with ElementTree."""
+    if request.param == 'lxml':
+        if not oai.HAS_LXML:
+            pytest.skip('lxml is not installed')
+    else:
+        monkeypatch.setattr(oai, 'ET', StdlibET)
+        monkeypatch.setattr(oai, 'HAS_LXML', False)
+    # Namespaces registered with one library aren't registered with
+    # the other.
+    monkeypatch.setattr(oai, '_registered_namespaces', {})
+    return request.param
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the endpoint's sleeps instead of sleeping."""
+    sleeps = []
+    monkeypatch.setattr(oai, 'time', SimpleNamespace(sleep=sleeps.append))
+    return sleeps
+
+
+@pytest.fixture
+def make_endpoint(monkeypatch, sleeps):
+    """Makes an Endpoint that serves canned pages instead of going out
+    to the network.
+
+    Pages are given as a dict mapping the request's query arguments
+    (minus 'verb') to the page bytes, e.g. {FIRST_PAGE: b'...'}. A page
+    may also be an exception to raise, or a list of pages and
+    exceptions to serve in turn. Each request made is recorded in the
+    endpoint's 'requests' list.
+    """
+    def _make_endpoint(pages, **kwargs):
+        kwargs.setdefault('verbose', False)
+        endpoint = oai.Endpoint(
+            'https://example.com/oai/', namespaces=dict(NAMESPACES), **kwargs
+        )
+        endpoint.requests = []
+
+        def send_request(req_url):
+            querystring = req_url.split('?', 1)[1]
+            endpoint.requests.append(querystring)
+            arguments = parse_qsl(querystring)
+            page = pages[tuple(a for a in arguments if a[0] != 'verb')]
+            if isinstance(page, list):
+                page = page.pop(0) if len(page) > 1 else page[0]
+            if isinstance(page, Exception):
+                raise page
+            return page
+
+        monkeypatch.setattr(endpoint, '_send_request', send_request)
+        return endpoint
+    return _make_endpoint
+
+
+@pytest.fixture
+def make_harvester(make_endpoint):
+    """Makes a Harvester whose endpoint serves canned pages (see
+    'make_endpoint').
+    """
+    def _make_harvester(pages, options=None, **kwargs):
+        harvester = oai.Harvester('https://example.com/oai/', options or {},
+                                  NAMESPACES, verbose=False, **kwargs)
+        harvester.endpoint = make_endpoint(pages)
+        return harvester
+    return _make_harvester
+
+
+@pytest.mark.parametrize('arguments, expected', [
+    ({'metadataPrefix': 'untl_raw', 'set': 'access_rights:public'},
+     '?verb=ListIdentifiers&metadataPrefix=untl_raw'
+     '&set=access_rights:public'),
+    ({'metadataPrefix': 'oai_dc', 'from': None, 'until': None},
+     '?verb=ListIdentifiers&metadataPrefix=oai_dc'),
+    ({'resumptionToken': 'a/b+c=d&e f'},
+     '?verb=ListIdentifiers&resumptionToken=a%2Fb%2Bc%3Dd%26e+f'),
+    ({}, '?verb=ListIdentifiers'),
+    ('metadataPrefix=oai_dc', '?verb=ListIdentifiers&metadataPrefix=oai_dc'),
+    ('', '?verb=ListIdentifiers'),
+])
+def test_make_querystring(arguments, expected):
+    assert oai.make_querystring('ListIdentifiers', arguments) == expected
+
+
+def test_encode_arguments_round_trips_token():
+    token = 'ark:/67531/x+y==/&set=z'
+    encoded = oai.encode_arguments({'resumptionToken': token})
+    assert parse_qsl(encoded) == [('resumptionToken', token)]
+
+
+@pytest.mark.parametrize('tagname, expected', [
+    ('oai:record', oai.TAG_RECORD),
+    ('oai:identifier', oai.TAG_IDENTIFIER),
+    ('oai:resumptionToken', oai.TAG_RESUMPTION_TOKEN),
+    ('oai:error', oai.TAG_ERROR),
+    (oai.TAG_RECORD, oai.TAG_RECORD),
+    ('record', 'record'),
+    (None, None),
+])
+def test_expand_tagname(tagname, expected):
+    assert oai.expand_tagname(tagname, NAMESPACES) == expected
+
+
+def test_expand_tagname_unknown_prefix():
+    with pytest.raises(ValueError):
+        oai.expand_tagname('foo:record', NAMESPACES)
+
+
+@pytest.mark.parametrize('raw_page, expected', [
+    (make_id_page([b'a'], b'<resumptionToken>abc</resumptionToken>'),
+     'abc'),
+    (make_id_page([b'a'], b'<resumptionToken cursor="0" '
+                          b'completeListSize="2">abc</resumptionToken>'),
+     'abc'),
+    (b'<oai:resumptionToken>abc</oai:resumptionToken>', 'abc'),
+    (make_id_page([b'a'], b'<resumptionToken>a/b+c=d&amp;e</resumptionToken>'),
+     'a/b+c=d&e'),
+    (make_id_page([b'a'], b'<resumptionToken><![CDATA[a&b]]>'
+                          b'</resumptionToken>'),
+     'a&b'),
+    (make_id_page([b'a'], b'<resumptionToken cursor="1"></resumptionToken>'),
+     None),
+    (make_id_page([b'a'], b'<resumptionToken cursor="1"/>'), None),
+    (make_id_page([b'a']), None),
+], ids=['plain', 'attributes', 'prefixed', 'escaped', 'cdata', 'empty',
+        'self-closing', 'missing'])
+def test_find_resumption_token(raw_page, expected):
+    assert oai.find_resumption_token(raw_page) == expected
+
+
+@pytest.mark.parametrize('raw_page, expected', [
+    (make_id_page([b'ark:/67531/a', b'ark:/67531/b']),
+     ['ark:/67531/a', 'ark:/67531/b']),
+    (b'<oai:header><oai:identifier>ark:/1/a</oai:identifier></oai:header>',
+     ['ark:/1/a']),
+    (make_id_page([b'a&amp;b', b'&#x3C;c&#62;', b'&amp;lt;', b'&#128;']),
+     ['a&b', '<c>', '&lt;', '\x80']),
+    (make_id_page([b'<![CDATA[a&b]]>', b'c']), ['a&b', 'c']),
+    (make_id_page([]), []),
+], ids=['plain', 'prefixed', 'escaped', 'cdata', 'none'])
+def test_rawfilter_ids(raw_page, expected):
+    assert oai.rawfilter_ids(raw_page) == expected
+
+
+@pytest.mark.parametrize('ids', [
+    [b'ark:/67531/a', b'a&amp;b', b'&#x3C;c&#62;', b'&amp;lt;', b'&#128;'],
+    [b'a', b'<![CDATA[ark:/1/c]]>'],
+], ids=['escaped', 'cdata'])
+def test_rawfilter_ids_matches_docfilter_ids(ids):
+    raw_page = make_id_page(ids)
+    page = oai.ETreeXmlDoc.fromstring(raw_page, NAMESPACES)
+    assert oai.rawfilter_ids(raw_page) == oai.docfilter_ids(page)
+
+
+def test_etreexmldoc_find(etree_backend):
+    doc = oai.ETreeXmlDoc.fromstring(
+        make_records_page([make_record(b'id1', b'One'),
+                           make_record(b'id2', b'Two')]),
+        NAMESPACES
+    )
+    assert doc.find_tag('oai:identifier').text == 'id1'
+    assert doc.find_tag('oai:identifier', text='id2').text == 'id2'
+    assert doc.find_path('.//untl:title').text == 'One'
+    assert [el.text for el in doc.findall_tag('untl:title')] == [
+        'One', 'Two'
+    ]
+    assert [el.text for el in doc.findall_path('.//oai:identifier')] == [
+        'id1', 'id2'
+    ]
+    assert doc.find_tag('oai:setSpec') is None
+
+
+def test_etreexmldoc_shares_tagname_cache(etree_backend):
+    doc = oai.ETreeXmlDoc.fromstring(
+        make_records_page([make_record(b'id1', b'One')]), NAMESPACES
+    )
+    assert not hasattr(doc, '__dict__')
+    record = doc.find_tag('oai:record')
+    assert record._expanded is doc._expanded
+    assert doc._expanded['oai:record'] == oai.TAG_RECORD
+
+
+def test_etreexmldoc_does_not_resolve_entities(etree_backend, tmp_path):
+    secret = tmp_path / 'secret.txt'
+    secret.write_text('secret')
+    xml = (
+        '<!DOCTYPE r [<!ENTITY e SYSTEM "%s">]><r>&e;</r>' % secret.as_uri()
+    )
+    try:
+        doc = oai.ETreeXmlDoc.fromstring(xml)
+    except StdlibET.ParseError:
+        # ElementTree refuses external entities outright.
+        return
+    assert doc.text != 'secret'
+
+
+def test_tostring_uses_registered_prefixes(etree_backend):
+    doc = oai.ETreeXmlDoc.fromstring(
+        make_records_page([make_record(b'id1', b'One')]), NAMESPACES
+    )
+    xml = doc.find_tag('oai:record').tostring(encoding='unicode')
+    assert xml.startswith('<oai:record ')
+    assert f'xmlns:oai="{NAMESPACES["oai"]}"' in xml
+    assert '<untl:title>One</untl:title>' in xml
+
+
+def test_tostring_round_trips(etree_backend):
+    doc = oai.ETreeXmlDoc.fromstring(
+        make_records_page([make_record(b'id1', b'A &amp; B')]), NAMESPACES
+    )
+    xml = doc.find_tag('oai:record').tostring(encoding='utf-8')
+    record = oai.ETreeXmlDoc.fromstring(xml, NAMESPACES)
+    assert record.find_tag('oai:identifier').text == 'id1'
+    assert record.find_tag('untl:title').text == 'A & B'
+
+
+def test_endpoint_session():
+    endpoint = oai.Endpoint('https://example.com/oai/', verbose=False)
+    assert isinstance(endpoint.session, requests.Session)
+    assert endpoint.session.headers['User-Agent'] == 'untdl_harvest'
+    assert endpoint.session.headers['Accept-Encoding'] == 'gzip, deflate'
+    adapter = endpoint.session.get_adapter('https://example.com/oai/')
+    assert adapter.max_retries.status_forcelist == oai.RETRY_STATUSES
+    assert adapter.max_retries.total == endpoint.max_recoveries
+
+
+def test_send_request_counts_bytes(monkeypatch):
+    endpoint = oai.Endpoint('https://example.com/oai/', verbose=False)
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'decoded page data'
+    response.raw = SimpleNamespace(tell=lambda: 7)
+    urls = []
+
+    def get(url):
+        urls.append(url)
+        return response
+
+    monkeypatch.setattr(endpoint.session, 'get', get)
+    assert endpoint._send_request('https://example.com/oai/?verb=x') == (
+        b'decoded page data'
+    )
+    assert urls == ['https://example.com/oai/?verb=x']
+    assert endpoint.raw_bytes == 7
+
+
+def test_get_page_counts_decoded_bytes(make_endpoint):
+    raw_page = make_id_page([b'id1'])
+    endpoint = make_endpoint({FIRST_PAGE: raw_page})
+    endpoint.get_page('ListIdentifiers', {'metadataPrefix': 'oai_dc'})
+    assert endpoint.data_bytes == len(raw_page)
+
+
+def test_send_request_raises_http_errors(monkeypatch):
+    endpoint = oai.Endpoint('https://example.com/oai/', verbose=False)
+    response = requests.Response()
+    response.status_code = 404
+    monkeypatch.setattr(endpoint.session, 'get', lambda url: response)
+    with pytest.raises(requests.HTTPError):
+        endpoint._send_request('https://example.com/oai/?verb=x')
+
+
+def test_get_page_recovers_from_http_error(make_endpoint, sleeps):
+    endpoint = make_endpoint(
+        {FIRST_PAGE: [make_http_error(500), make_id_page([b'id1'])]}
+    )
+    page = endpoint.get_page('ListIdentifiers', {'metadataPrefix': 'oai_dc'})
+    assert oai.docfilter_ids(page) == ['id1']
+    assert len(endpoint.requests) == 2
+    assert len(sleeps) == 1
+    assert 1 <= sleeps[0] <= 3
+
+
+def test_get_page_bails_after_max_recoveries(make_endpoint, sleeps):
+    endpoint = make_endpoint({FIRST_PAGE: make_http_error(500)},
+                             max_recoveries=3)
+    with pytest.raises(oai.EndpointError, match='max number of recovery'):
+        endpoint.get_page('ListIdentifiers', {'metadataPrefix': 'oai_dc'})
+    assert len(endpoint.requests) == 4
+    assert len(sleeps) == 3
+    assert len(endpoint.http_errors) == 4
+
+
+def test_recoveries_are_counted_per_request(make_endpoint, monkeypatch):
+    good_page = (('identifier', 'good'),)
+    endpoint = make_endpoint({
+        (('identifier', 'bad'),): make_http_error(500),
+        good_page: make_page(b'<GetRecord/>'),
+    }, max_recoveries=3)
+
+    def sleep_while_another_thread_succeeds(seconds):
+        thread = threading.Thread(
+            target=endpoint.get_raw_page, args=('GetRecord', dict(good_page))
+        )
+        thread.start()
+        thread.join()
+
+    monkeypatch.setattr(
+        oai, 'time', SimpleNamespace(sleep=sleep_while_another_thread_succeeds)
+    )
+    with pytest.raises(oai.EndpointError, match='max number of recovery'):
+        endpoint.get_raw_page('GetRecord', {'identifier': 'bad'})
+    bad_requests = [r for r in endpoint.requests if 'bad' in r]
+    assert len(bad_requests) == endpoint.max_recoveries + 1
+    assert len(endpoint.requests) == 2 * endpoint.max_recoveries + 1
+
+
+@pytest.mark.parametrize('status_code', oai.RETRY_STATUSES)
+def test_get_page_does_not_retry_retry_statuses(make_endpoint, sleeps,
+                                                status_code):
+    # The session's urllib3 Retry has already retried these.
+    endpoint = make_endpoint({FIRST_PAGE: make_http_error(status_code)})
+    with pytest.raises(oai.EndpointError, match='still unavailable'):
+        endpoint.get_page('ListIdentifiers', {'metadataPrefix': 'oai_dc'})
+    assert len(endpoint.requests) == 1
+    assert sleeps == []
+
+
+def test_get_page_honors_retry_after(make_endpoint, sleeps):
+    endpoint = make_endpoint({FIRST_PAGE: [
+        make_http_error(429, {'Retry-After': '17'}), make_id_page([b'id1'])
+    ]})
+    endpoint.get_page('ListIdentifiers', {'metadataPrefix': 'oai_dc'})
+    assert sleeps == [17]
+
+
+def test_get_recovery_time(monkeypatch):
+    endpoint = oai.Endpoint('https://example.com/oai/', verbose=False)
+    monkeypatch.setattr(oai.random, 'uniform', lambda low, high: high)
+    assert endpoint._get_recovery_time(0) == 3
+    assert endpoint._get_recovery_time(3) == 9
+    assert endpoint._get_recovery_time(30) == endpoint.default_recovery_time
+    monkeypatch.setattr(oai.random, 'uniform', lambda low, high: low)
+    assert endpoint._get_recovery_time(30) == 1
+
+
+def test_get_page_raises_on_oai_error(make_endpoint):
+    endpoint = make_endpoint({FIRST_PAGE: ERROR_PAGE})
+    with pytest.raises(oai.EndpointError, match='badResumptionToken'):
+        endpoint.get_page('ListIdentifiers', {'metadataPrefix': 'oai_dc'})
+    assert endpoint.oai_error.code == 'badResumptionToken'
+    assert endpoint.oai_error.message == 'The token is invalid.'
+
+
+def test_get_page_ignores_error_text(make_endpoint):
+    raw_page = make_id_page([b'terror'], b'<!-- <error> -->')
+    endpoint = make_endpoint({FIRST_PAGE: raw_page})
+    page = endpoint.get_page('ListIdentifiers', {'metadataPrefix': 'oai_dc'})
+    assert oai.docfilter_ids(page) == ['terror']
+
+
+def test_compile_data_follows_resumption_tokens(make_endpoint):
+    token = 'a/b+c=d&e'
+    endpoint = make_endpoint({
+        FIRST_PAGE: make_id_page(
+            [b'id1', b'id2'],
+            b'<resumptionToken>a/b+c=d&amp;e</resumptionToken>'
+        ),
+        (('resumptionToken', token),): make_id_page(
+            [b'id3'], b'<resumptionToken/>'
+        ),
+    })
+    ids = endpoint.compile_data(
+        'ListIdentifiers', {'metadataPrefix': 'oai_dc'}, oai.docfilter_ids
+    )
+    assert ids == ['id1', 'id2', 'id3']
+    assert endpoint.requests == [
+        'verb=ListIdentifiers&metadataPrefix=oai_dc',
+        'verb=ListIdentifiers&resumptionToken=a%2Fb%2Bc%3Dd%26e',
+    ]
+
+
+def test_iter_raw_pages_prefetches_next_page(make_endpoint):
+    endpoint = make_endpoint({
+        FIRST_PAGE: make_id_page(
+            [b'id1'], b'<resumptionToken>t1</resumptionToken>'
+        ),
+        (('resumptionToken', 't1'),): make_id_page([b'id2']),
+    })
+    pages = endpoint.iter_raw_pages(
+        'ListIdentifiers', {'metadataPrefix': 'oai_dc'}
+    )
+    assert oai.rawfilter_ids(next(pages)) == ['id1']
+    # Give the prefetcher a moment to request the next page.
+    for _ in range(100):
+        if len(endpoint.requests) == 2:
+            break
+        threading.Event().wait(0.01)
+    assert len(endpoint.requests) == 2
+    assert oai.rawfilter_ids(next(pages)) == ['id2']
+    assert list(pages) == []
+
+
+def test_iter_raw_data_skips_parsing(make_endpoint, monkeypatch):
+    endpoint = make_endpoint({FIRST_PAGE: make_id_page([b'terror'])})
+    monkeypatch.setattr(endpoint, 'parse_page', None)
+    ids = endpoint.compile_raw_data(
+        'ListIdentifiers', {'metadataPrefix': 'oai_dc'}, oai.rawfilter_ids
+    )
+    assert ids == ['terror']
+
+
+@pytest.mark.parametrize('raw_page', [
+    ERROR_PAGE,
+    make_page(b'<oai:error xmlns:oai="http://www.openarchives.org/OAI/2.0/" '
+              b'code="noRecordsMatch"/>'),
+], ids=['plain', 'prefixed'])
+def test_iter_raw_data_raises_on_oai_error(make_endpoint, raw_page):
+    endpoint = make_endpoint({FIRST_PAGE: raw_page})
+    with pytest.raises(oai.EndpointError):
+        list(endpoint.stream_ids({'metadataPrefix': 'oai_dc'}))
+
+
+def test_get_ids(make_harvester):
+    token = 'a/b+c=d&e'
+    harvester = make_harvester({
+        FIRST_PAGE: make_id_page(
+            [b'id1', b'id2'],
+            b'<resumptionToken>a/b+c=d&amp;e</resumptionToken>'
+        ),
+        (('resumptionToken', token),): make_id_page(
+            [b'id3'], b'<resumptionToken/>'
+        ),
+    })
+    assert harvester.get_ids() == ['id1', 'id2', 'id3']
+    assert list(harvester.stream_ids()) == ['id1', 'id2', 'id3']
+
+
+def test_get_ids_with_docfilter(make_harvester):
+    harvester = make_harvester({FIRST_PAGE: make_id_page([b'id1', b'id2'])})
+
+    def docfilter_upper_ids(page):
+        return [i.upper() for i in oai.docfilter_ids(page)]
+
+    assert harvester.get_ids(docfilter=docfilter_upper_ids) == ['ID1', 'ID2']
+    assert harvester.get_ids(docfilter_upper_ids) == ['ID1', 'ID2']
+
+
+def test_get_ids_raises_on_oai_error(make_harvester):
+    harvester = make_harvester({FIRST_PAGE: ERROR_PAGE})
+    with pytest.raises(oai.EndpointError, match='badResumptionToken'):
+        harvester.get_ids()
+
+
+def test_harvester_encodes_options_once(make_harvester):
+    options = {'metadataPrefix': 'untl', 'set': 'a:b c'}
+    harvester = make_harvester({
+        (('metadataPrefix', 'untl'), ('set', 'a:b c')): make_id_page([b'a'])
+    }, options)
+    assert harvester.get_ids() == ['a']
+    assert harvester.endpoint.requests == [
+        'verb=ListIdentifiers&metadataPrefix=untl&set=a:b+c'
+    ]
+
+
+def test_list_records(etree_backend, make_harvester):
+    harvester = make_harvester({
+        (('metadataPrefix', 'untl'),): make_records_page(
+            [make_record(b'id1', b'One')],
+            b'<resumptionToken>t1</resumptionToken>'
+        ),
+        (('resumptionToken', 't1'),): make_records_page(
+            [make_record(b'id2', b'Two')]
+        ),
+    }, {'metadataPrefix': 'untl'})
+    records = harvester.list_records()
+    assert [r.find_path('.//untl:title').text for r in records] == [
+        'One', 'Two'
+    ]
+    assert [oai.docfilter_ids(r) for r in records] == [['id1'], ['id2']]
+
+
+def test_list_records_raises_on_oai_error(make_harvester):
+    harvester = make_harvester({FIRST_PAGE: ERROR_PAGE})
+    with pytest.raises(oai.EndpointError):
+        harvester.list_records()
+
+
+def test_get_record(etree_backend, make_harvester):
+    harvester = make_harvester({
+        (('metadataPrefix', 'oai_dc'), ('identifier', 'ark:/1/a')):
+            make_page(b'<GetRecord>%s</GetRecord>' % make_record(
+                b'ark:/1/a', b'A'
+            )),
+    })
+    record = harvester.get_record('ark:/1/a')
+    assert record.find_path('.//untl:title').text == 'A'
+    assert harvester.endpoint.requests == [
+        'verb=GetRecord&metadataPrefix=oai_dc&identifier=ark:%2F1%2Fa'
+    ]
+
+
+def test_get_record_caches_found_records_only(make_harvester):
+    harvester = make_harvester({
+        (('metadataPrefix', 'oai_dc'), ('identifier', 'id1')):
+            make_page(b'<GetRecord>%s</GetRecord>' % make_record(b'id1', b'A')),
+        (('metadataPrefix', 'oai_dc'), ('identifier', 'id2')):
+            make_page(b'<GetRecord>%s</GetRecord>' % make_record(b'id2', b'B')),
+        (('metadataPrefix', 'oai_dc'), ('identifier', 'none')):
+            make_page(b'<GetRecord/>'),
+    }, record_cache_size=1)
+    requests_made = harvester.endpoint.requests
+    title = './/untl:title'
+    assert harvester.get_record('id1').find_path(title).text == 'A'
+    assert harvester.get_record('id1').find_path(title).text == 'A'
+    assert len(requests_made) == 1
+    assert harvester.get_record('id2').find_path(title).text == 'B'
+    assert harvester.get_record('id1').find_path(title).text == 'A'
+    assert len(requests_made) == 3
+    assert harvester.get_record('none') is None
+    assert harvester.get_record('none') is None
+    assert len(requests_made) == 5
@@ -0,0 +1,90 @@
+"""Tests for the untdl_harvest.pdf module."""
+from io import BytesIO
+
+import pytest
+
+from untdl_harvest import oai, pdf
+
+
+PAGE_TEXTS = [
+    'Page one\x0c',
+    'Tom & Jerry <cartoon>\r\n"quoted" \'single\'',
+    'Bad\x00chars\x1b here\ud800, good ones here: \tcafé \U0001F600',
+    '',
+]
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with pdf.make_process_pool(2) as pool:
+        yield pool
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('plain text', 'plain text'),
+    ('form\x0cfeed', 'formfeed'),
+    ('nul\x00 esc\x1b', 'nul esc'),
+    ('lone \ud800 surrogate', 'lone  surrogate'),
+    ('\t\n\r kept', '\t\n\r kept'),
+    ('café \U0001F600', 'café \U0001F600'),
+])
+def test_clean_text(text, expected):
+    assert pdf.clean_text(text) == expected
+
+
+def test_make_text_xml():
+    doc = pdf.make_text_xml(PAGE_TEXTS)
+    xml = doc.tostring(encoding='utf-8', xml_declaration=True)
+    pages = oai.ETreeXmlDoc.fromstring(xml).findall_tag('page')
+    # ElementTree writes '\r' as-is, so it doesn't survive parsing.
+    assert [page.text.replace('\r', '') for page in pages] == [
+        f'\n{pdf.clean_text(text)}\n'.replace('\r', '')
+        for text in PAGE_TEXTS
+    ]
+
+
+@pytest.mark.skipif(not oai.HAS_LXML, reason='lxml is not installed')
+def test_make_text_xml_bytes_matches_lxml():
+    doc = pdf.make_text_xml(PAGE_TEXTS)
+    expected = doc.tostring(encoding='utf-8', xml_declaration=True)
+    assert pdf.make_text_xml_bytes(PAGE_TEXTS) == expected
+
+
+def test_make_text_xml_bytes_round_trips():
+    xml = pdf.make_text_xml_bytes(PAGE_TEXTS)
+    pages = oai.ETreeXmlDoc.fromstring(xml).findall_tag('page')
+    assert [page.text for page in pages] == [
+        f'\n{pdf.clean_text(text)}\n' for text in PAGE_TEXTS
+    ]
+
+
+def test_extract_page_texts_from_bytes(make_pdf):
+    pdf_bytes = make_pdf(['Page one', 'Page two'])
+    expected = ['Page one', 'Page two']
+    assert pdf.extract_page_texts_from_bytes(pdf_bytes) == expected
+    assert pdf.extract_page_texts_from_bytes(BytesIO(pdf_bytes)) == expected
+
+
+def test_extract_page_texts_from_bytes_in_pool(make_pdf, pool, tmp_path):
+    texts = [f'Page {i}' for i in range(7)]
+    pdf_bytes = make_pdf(texts)
+    pdf_path = tmp_path / 'test.pdf'
+    pdf_path.write_bytes(pdf_bytes)
+    assert pdf.extract_page_texts_from_bytes(pdf_bytes, pool) == texts
+    assert pdf.extract_page_texts_from_bytes(BytesIO(pdf_bytes), pool) == texts
+    with open(pdf_path, 'rb') as pdf_file:
+        assert pdf.extract_page_texts_from_bytes(pdf_file, pool) == texts
+    # Workers keep readers for PDFs they've seen; make sure a new PDF
+    # doesn't get an old one's text.
+    for i in range(pdf.WORKER_READERS + 1):
+        other_texts = [f'Other {i}', 'Other']
+        assert pdf.extract_page_texts_from_bytes(
+            make_pdf(other_texts), pool
+        ) == other_texts
+
+
+def test_extract_text_as_xml_from_bytes(make_pdf):
+    doc = pdf.extract_text_as_xml_from_bytes(make_pdf(['One', 'Two']))
+    assert [page.text for page in doc.findall_tag('page')] == [
+        '\nOne\n', '\nTwo\n'
+    ]